@@ -1,47 +1,337 @@
+import functools
+import re
+import sys
+import weakref
+
+
+# Таблица экранирования спецсимволов HTML в тексте и значениях аттрибутов: str.translate делает замену за один проход
+_ESCAPE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'})
+_NEEDS_ESCAPE = re.compile('[&<>"]').search
+_FLUSH_LINES = 4096 # по столько строк за раз готовые строки склеиваются для записи в файл
+
+
+def _write_lines(write, lines, end):
+    # Запишет строки через '\n' кусками по _FLUSH_LINES строк, чтобы не склеивать в памяти копию всего документа; end допишется в конце
+    for start in range(0, len(lines), _FLUSH_LINES):
+        if start:
+            write('\n')
+        write('\n'.join(lines[start:start + _FLUSH_LINES]))
+    write(end)
+
+
+def _escape(value):
+    # Поиск по регулярному выражению заметно дешевле translate, а спецсимволы в тексте и аттрибутах встречаются редко --
+    # поэтому translate вызывается только когда есть что заменять
+    if value.__class__ is not str:
+        value = str(value)
+    return value.translate(_ESCAPE) if _NEEDS_ESCAPE(value) else value
+
+
+@functools.lru_cache(maxsize=256)
+def _hyphenate(attr):
+    # Имена аттрибутов повторяются от тэга к тэгу, поэтому замена underline на дефисы кэшируется, а результат интернируется
+    return sys.intern(attr.replace('_', '-'))
+
+
+def _attr_name(attr):
+    # Имя аттрибута в словаре тэга: underline заменяется на дефисы, любое имя интернируется
+    # (ключи, переданные через **dict, сам Python не интернирует)
+    return _hyphenate(attr) if '_' in attr else sys.intern(attr)
+
+
 class Tag:
     """
     Класс реализует возможность создавать HTML-тэги в Python. 
     Класс Tag(tag(str), klass(str or tuple or list), is_single(bool), <tag-properties as **kwargs>) --
         позволяет работать с любым тэгом, задавать ему .text, аргументы, вложенные тэги.
-    Добавление вложенного тега организовано перегрузкой оператора '+=' (__iadd__).
+    Добавление вложенного тега организовано перегрузкой оператора '+=' (__iadd__), список тэгов можно добавить через '+=' или .extend().
     Поддерживается работа с контекстным менеджером, приведение экземпляра к str.
     Метод .get_lines(indent, set_offset) вернёт список из строк тега с учётом отступов во вложенных тэгах:
         - аргумент indent(str) отвечает за формат отступов вложенных элементов, 
         - аргумент set_offset(int) даст отступы формата indent(str) самому тэгу -- для случая необходимости вставки его указанное место файла.
+    Спецсимволы HTML (&, <, >, ") в .text и значениях аттрибутов экранируются.
+    Результат вывода (str(), .get_lines()) кэшируется у выводимого тэга и сбрасывается при изменении .text, .is_single
+    и добавлении потомков через '+=' в любом месте его дерева. Tag.cache_output = False отключает кэш.
+    Вложенные тэги ссылаются на родителей через weakref и не удерживают в памяти документы, в которые их добавили.
+    Тэг нельзя вложить в самого себя или в собственного потомка -- '+=' в этом случае выбросит ValueError.
+    Аттрибуты тэга задаются только в конструкторе, список .children напрямую менять не следует -- кэш об этом не узнает.
     """
+    # Фиксированный набор полей вместо __dict__: экземпляр занимает меньше памяти, а чтение полей при выводе быстрее.
+    # __weakref__ оставляет возможность ссылаться на тэги через weakref, как и до появления __slots__
+    __slots__ = ('tag', 'attributes', '_is_single', 'children', '_text', '_esc_text', '_indent', '_attr_str', '_open', '_close', '_single',
+                 '_render_cache', '_in_cache', '_parents', '__weakref__')
+
+    cache_output = True # кэшировать ли результат вывода тэга
+
     def __init__(self, tag, klass = (), is_single = False, **kwargs):
+        self._init_state(sys.intern(tag), is_single) # имена тэгов повторяются по всему документу -- храним одну копию строки
+        self._set_attributes(klass, kwargs)
+
+    def _set_attributes(self, klass, kwargs):
+        # Все аттрибуты вместе с классом тега будут храниться в одном словаре, класс -- первым.
+        # Строку с одним классом берём как есть, кортеж или список классов склеиваем, прочие значения klass игнорируются
+        if not klass:
+            attributes = {}
+        elif klass.__class__ is str:
+            attributes = {'class': klass}
+        elif klass.__class__ is tuple or klass.__class__ is list:
+            attributes = {'class': ' '.join(klass)}
+        else:
+            attributes = {}
+        for attr, value in kwargs.items(): # с заменой underline на дефисы и интернированием имени
+            attributes[_attr_name(attr)] = value
+        self.attributes = attributes
+        self._prepare()
+
+    def _init_state(self, tag, is_single):
+        # Начальные значения полей тэга, кроме аттрибутов, -- общие для конструктора и Tag.many()
         self.tag = tag
-        self.attributes = {}
-        self.is_single = is_single
+        self._is_single = is_single
         self.children = []
-        self.text = ""
-        self.indent = 4*' ' # Для вывода дочерних элементов по-умолчанию используется четыре пробела
-
-        if klass: # Если что-либо указали в аргументе klass
-            if type(klass) is tuple or type(klass) is list: # Опишем, если несколько классов для тега
-                self.attributes['class'] = ' '.join(klass)
-            elif type(klass) is str: # Опишем, если один лишь класс передан в виде строки
-                self.attributes['class'] = klass
-        
-        # Все аттрибуты вместе с классом тега будут храниться в словаре
-        for attr, value in kwargs.items():             
-            self.attributes[ attr.replace('_', '-') ] = value # С заменой underline на дефисы
+        self._text = ""
+        self._esc_text = "" # экранированный текст -- считается один раз при присвоении .text
+        self._render_cache = None # (prefix, indent, lines) последнего вывода, если этот тэг выводили
+        self._in_cache = False # True, если строки тэга могут лежать в кэше его самого или одного из предков
+        self._parents = None # {id(родитель): weakref на родителя} -- им нужно сбрасывать кэш при изменениях; создаётся при первом добавлении
+
+    def _prepare(self):
+        # Аттрибуты задаются только при создании тэга, поэтому строки тэга собираются один раз, а не при каждом выводе.
+        # В str.join всегда передаём готовый список (list comprehension), а не генератор: по списку join сразу знает размер результата
+        self._attr_str = (' ' + ' '.join([f'{attr}="{_escape(value)}"' for attr, value in self.attributes.items()])) if self.attributes else ''
+        self._open = f'<{self.tag}{self._attr_str}>'
+        self._close = f'</{self.tag}>'
+        self._single = f'<{self.tag}{self._attr_str}/>'
+
+    def _share(self, template):
+        # Возьмёт у тэга-образца с теми же аргументами готовые строки тэга; словарь аттрибутов у каждого тэга свой
+        self.attributes = dict(template.attributes)
+        self._attr_str = template._attr_str
+        self._open = template._open
+        self._close = template._close
+        self._single = template._single
+
+    @classmethod
+    def many(cls, tag, rows, klass = (), **kwargs):
+        """
+        Метод вернёт список однотипных парных тэгов (строки таблицы, пункты списка) без вызова конструктора для каждого.
+        rows -- последовательность пар (text, extra_attrs): текст тэга и словарь дополнительных аттрибутов (или None).
+        klass и **kwargs задают общие для всех тэгов аттрибуты, как в конструкторе Tag -- они разбираются один раз,
+        и тэги без дополнительных аттрибутов получают копию общего словаря аттрибутов и готовые строки тэга.
+        """
+        template = Tag(tag, klass, **kwargs)
+        tags = []
+        for text, extra_attrs in rows:
+            node = cls.__new__(cls)
+            node._init_state(template.tag, False)
+            if text: # пустой текст и None, как и у тэга из конструктора, строки текста не дают
+                node.text = text
+            if extra_attrs:
+                node.attributes = {**template.attributes, **{_attr_name(attr): value for attr, value in extra_attrs.items()}}
+                node._prepare()
+            else:
+                node._share(template)
+            tags.append(node)
+        return tags
     
+    default_indent = 4*' ' # Для вывода дочерних элементов по-умолчанию используется четыре пробела, общий для всех тэгов
+
+    @property
+    def indent(self):
+        # Слот _indent заполняется только при явном переназначении отступа (например, doc.indent = '--'), иначе берётся общий отступ класса
+        try:
+            return self._indent
+        except AttributeError:
+            return self.default_indent
+
+    @indent.setter
+    def indent(self, value):
+        self._indent = value
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+        self._esc_text = _escape(value) if value else "" # None и пустой текст не выводятся
+        if self._in_cache:
+            self._invalidate()
+
+    @property
+    def is_single(self):
+        return self._is_single
+
+    @is_single.setter
+    def is_single(self, value):
+        self._is_single = value
+        if self._in_cache:
+            self._invalidate()
+
+    def _live_parents(self):
+        # Вернёт список ещё существующих родителей, заодно удалив ссылки на уже собранные сборщиком мусора
+        parents = self._parents
+        if not parents:
+            return ()
+        live = []
+        for key, ref in list(parents.items()):
+            parent = ref()
+            if parent is None:
+                del parents[key]
+            else:
+                live.append(parent)
+        return live
+
+    def _invalidate(self):
+        # Сбросим кэш вывода у самого тэга и у всех тэгов, которые его содержат.
+        # Вывод с кэшем помечает все тэги дерева флагом _in_cache: тэг без флага не лежит ни в одном кэше,
+        # и на нём подъём останавливается. Флаг снимается до перехода к родителям, так что каждый тэг
+        # обрабатывается не больше одного раза (это же защищает от циклов и повторов в цепочке родителей)
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._in_cache:
+                node._in_cache = False
+                node._render_cache = None
+                stack.extend(node._live_parents())
+
+    def _is_inside(self, other):
+        # True, если текущий тэг -- это other или один из его потомков (поиск идёт вверх по родителям)
+        seen = set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node is other:
+                return True
+            if node not in seen:
+                seen.add(node)
+                stack.extend(node._live_parents())
+        return False
+
+    def _check_nesting(self, other):
+        # Проверит, что other можно вложить в текущий тэг.
+        # Тэг без потомков может оказаться предком только самому себе, а тэг без родителей вложен только сам в себя,
+        # поэтому подъём по родителям нужен не всегда
+        if other is self or (other.children and self._parents and self._is_inside(other)):
+            raise ValueError(f'Тэг <{other.tag}> нельзя вложить в самого себя или в собственного потомка')
+
+    def _adopt(self, other):
+        # Запомнит текущий тэг среди родителей other. Ссылка слабая: общий для многих документов тэг
+        # (например, меню) не должен удерживать их в памяти. Повторное добавление в тот же тэг не создаёт второй записи
+        parents = other._parents
+        if parents is None:
+            other._parents = {id(self): weakref.ref(self)}
+        else:
+            parents[id(self)] = weakref.ref(self)
+
     def __enter__(self): # для использования контекстных менеджеров
         return self # в базовом класе нет поведения, поэтому заглушка
     def __exit__(self, *args, **kwargs): # для использования контекстных менеджеров
         pass # в базовом класе нет поведения, поэтому заглушка
 
     def __iadd__(self, other): # перегрузка оператора '+='
-       
+        if type(other) is list: # список тэгов добавляется целиком, например body += Tag.many('p', rows)
+            self.extend(other)
+            return self
+
         # Определим поведение только в случае добавления нашей сущности
-        if isinstance(other, Tag):  # if type(other) is Tag: - не подойдёт т.к. в HTML будем добавлять TopLevelTag, а он не Tag
+        # Проверка type() in _TAG_TYPES срабатывает для классов этого модуля без обхода MRO, isinstance -- для пользовательских наследников
+        if type(other) in _TAG_TYPES or isinstance(other, Tag):  # if type(other) is Tag: - не подойдёт т.к. в HTML будем добавлять TopLevelTag, а он не Tag
+            self._check_nesting(other)
+            self._adopt(other)
             self.children.append(other)
+            if self._in_cache: # пока документ не выводился, сбрасывать нечего
+                self._invalidate()
         return self
 
+    def extend(self, others):
+        """
+        Метод добавит сразу несколько вложенных тэгов: список потомков расширяется одним вызовом, кэш сбрасывается один раз.
+        Как и '+=', всё, что не является тэгом, пропускается. Все тэги проверяются до изменения дерева:
+        если хоть один вложить нельзя, ValueError выбрасывается и потомки не меняются.
+        """
+        others = [other for other in others if type(other) in _TAG_TYPES or isinstance(other, Tag)]
+        for other in others:
+            self._check_nesting(other)
+        for other in others:
+            self._adopt(other)
+        self.children.extend(others)
+        if self._in_cache:
+            self._invalidate()
+
     def __str__(self):
-        # переписал __str__ с учётом нового метода Tag.get_lines()
-        return '\n'.join(self.get_lines())
+        # переписал __str__ с учётом нового метода Tag._emit() -- все строки собираются в один общий список
+        return '\n'.join(self._lines('', self.indent))
+
+    def _lines(self, prefix, indent):
+        """
+        Вернёт строки тэга с отступом prefix, взяв их из кэша вывода, если тэг не менялся с прошлого вывода с теми же отступами.
+        Кэш хранится только у выводимого тэга, а не у каждого поддерева, так что память на него не растёт с глубиной документа.
+        Возвращаемый список может оказаться кэшем -- изменять его нельзя.
+        """
+        cache = self._render_cache
+        if cache is not None and cache[0] == prefix and cache[1] == indent:
+            return cache[2]
+        lines = []
+        if self.cache_output:
+            self._emit(lines, prefix, indent, mark = True)
+            self._render_cache = (prefix, indent, lines)
+        else:
+            self._emit(lines, prefix, indent)
+        return lines
+
+    def _emit(self, out, prefix, indent, mark = False, spill = None):
+        """
+        Метод добавит строки текущего тэга со всем его содержимым в список out.
+        out -- общий для всего дерева список строк, в который пишут все вложенные тэги.
+        prefix -- готовый отступ текущего тэга, каждая строка формируется сразу с окончательным отступом.
+        indent -- оступы для внутрненних элементов.
+        mark -- пометить все выведенные тэги как попавшие в кэш (Tag._lines() кладёт результат в кэш).
+        spill -- функция, которой отдаётся out, когда в нём набирается _FLUSH_LINES строк; она должна сохранить строки и очистить out
+        (так HTML.flush() пишет документ в файл, не собирая его целиком в памяти).
+        Дерево обходится без рекурсии, через явный стек из (тэг, отступ, фаза):
+        фаза 0 -- вывести открывающий тэг, текст и поставить в очередь потомков, фаза 1 -- вывести закрывающий тэг.
+        Вложенный тэг, который выводили отдельно с теми же отступами и который с тех пор не менялся, просто копирует строки из своего кэша.
+        """
+        stack = [(self, prefix, 0)]
+        # методы списков и повторно читаемые поля узла держим в локальных переменных: LOAD_FAST дешевле поиска аттрибута
+        append = out.append
+        extend = out.extend
+        pop = stack.pop
+        push = stack.append
+        push_all = stack.extend
+        while stack:
+            node, prefix, phase = pop()
+            if phase: # все потомки уже выведены, закрываем тэг
+                append(prefix + node._close)
+                continue
+
+            if spill is not None and len(out) >= _FLUSH_LINES:
+                spill(out)
+
+            cache = node._render_cache
+            if cache is not None and cache[0] == prefix and cache[1] == indent: # поддерево не менялось с прошлого вывода
+                extend(cache[2])
+                continue
+
+            if mark:
+                node._in_cache = True
+            if node._is_single: # одиночный тег не содержит вложенных тегов и внутреннего текста, поэтому отображается одной строкой
+                append(prefix + node._single)
+                continue
+
+            # обработчик двойных тегов
+            push((node, prefix, 1))
+            append(prefix + node._open) # добавим строку открывающего тега с его свойствами
+            text = node._esc_text
+            if text:
+                append(f'{prefix}{indent}{text}')
+
+            children = node.children
+            if children:
+                # потомки кладутся в обратном порядке, чтобы из стека они достались в исходном
+                inner_prefix = prefix + indent
+                push_all([(inner, inner_prefix, 0) for inner in reversed(children)])
 
     def get_lines(self, indent = None, set_offset = 0): 
         """
@@ -49,44 +339,21 @@ class Tag:
         indent -- оступы для внутрненних элементов. 
         set_offset -- сдвиг элемента на set_offset отступов. Сделана с заделом на будущее использование класса и вставки тэга 
         внутрь существующего HTML-документа.
+        Оставлен для обратной совместимости -- вся работа выполняется в Tag._emit().
         """
         if indent is None: # __str__ использует indent=None, поэтому если необходимо переназначить отступы - сделай это в коде до вызова __str__
             indent = self.indent
 
-        attrs = []
-        for attr, value in self.attributes.items():
-            attrs.append('%s="%s"' % (attr, value))
-        attrs = ' '.join(attrs)
-
-        if self.is_single: # одиночный тег не содержит вложенных тегов и внутреннего текста, поэтому отображается одной строкой
-            return [f'{set_offset*indent}<{self.tag}{" " + attrs if attrs else ""}/>'] # Конструкция {" " if attrs else ""} заберёт пробел в случае отсутствия аргументов        
-        
-                    
-        # обработчик двойных тегов
-        lines = []
-        lines.append(f'<{self.tag}{" " + attrs if attrs else ""}>') # добавим строку открывающего тега с его свойствами
-        if self.text:
-            lines.append(indent + self.text )
-        
-        # каждой строке внутреннего тега добавим отступ
-        # осторожно, рекурсия!
-        for inner in self.children: # для каждого потомка ...
-            lines += [indent + line for line in inner.get_lines(indent)] # каждая его строка склеивается с отступом и весь его список строк добавляем в наш текущий
-        
-        lines.append(f'</{self.tag}>') # добавим строку с закрывающии тегом
-        
-        if set_offset:
-            return [(set_offset*indent) + line for line in lines]
-        return lines
+        return list(self._lines(set_offset*indent, indent)) # копия: список вызывающего не должен быть кэшем тэга
         
 
 class TopLevelTag(Tag):
     """
     Класс для добавления тегов верхнего уровня, например, <body>, <head>.
     Создан скорее для визуального отделения обычных тегов от верхних. Является всегда парным.
+    Собственного конструктора нет -- при создании сразу вызывается Tag.__init__ без лишнего вызова-обёртки.
     """
-    def __init__(self, tag, **kwargs):
-        super().__init__(tag, **kwargs) # задействуем конструктор наследуемого класса super().__init__
+    __slots__ = ()
 
 class HTML(Tag):
     """
@@ -95,9 +362,11 @@ class HTML(Tag):
     Поддерживается контекст. При выходе из контекста автоматически вызовется .flush().
     Для записи содержимого в файл / вывода на экран  -- вызвать метод .flush().
     """
+    __slots__ = ('output',)
+
     def __init__(self, out_filepath=None):
         self.output = out_filepath
-        super().__init__(tag = 'html')
+        Tag.__init__(self, 'html') # конструктор Tag вызывается напрямую, без поиска через super()
     
     def __exit__(self, *args, **kwargs):
         self.flush()
@@ -106,9 +375,25 @@ class HTML(Tag):
         if not type(self.output) is str:
             print(self)
         else:
-            with open(self.output, mode='w', encoding='UTF-8') as fp:                
-                fp.write('\n'.join(self.get_lines(indent = self.indent)))
-        
+            # документ не собирается целиком в памяти -- строки уходят в буферизованный файл кусками по _FLUSH_LINES строк.
+            # Содержимое файла совпадает с str(doc): перевода строки после последней строки нет
+            indent = self.indent
+            with open(self.output, mode='w', encoding='UTF-8', buffering=1<<16) as fp:
+                write = fp.write
+                cache = self._render_cache
+                if cache is not None and cache[0] == '' and cache[1] == indent:
+                    _write_lines(write, cache[2], '')
+                    return
+
+                def spill(lines):
+                    _write_lines(write, lines, '\n')
+                    lines.clear()
+
+                lines = []
+                self._emit(lines, '', indent, spill = spill)
+                _write_lines(write, lines, '')
+
+_TAG_TYPES = (Tag, TopLevelTag, HTML) # все классы тэгов модуля -- для быстрой проверки в Tag.__iadd__
 
 
 
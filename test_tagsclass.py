@@ -0,0 +1,294 @@
+import gc
+import os
+import sys
+import tempfile
+import unittest
+import weakref
+
+from tagsclass import HTML, Tag, TopLevelTag
+
+
+def build(text='first'):
+    doc = HTML()
+    body = TopLevelTag('body')
+    div = Tag('div', klass='container')
+    p = Tag('p')
+    p.text = text
+    div += p
+    body += div
+    doc += body
+    return doc, body, div, p
+
+
+class RenderCacheTest(unittest.TestCase):
+    def test_text_change_after_render(self):
+        doc, body, div, p = build()
+        str(doc)
+        p.text = 'second'
+        self.assertEqual(str(doc), str(build('second')[0]))
+
+    def test_iadd_after_render(self):
+        doc, body, div, p = build()
+        str(doc)
+        div += Tag('img', is_single=True, src='/icon.png')
+        expected, _, expected_div, _ = build()
+        expected_div += Tag('img', is_single=True, src='/icon.png')
+        self.assertEqual(str(doc), str(expected))
+
+    def test_is_single_change_after_render(self):
+        doc, body, div, p = build()
+        str(doc)
+        p.is_single = True
+        self.assertIn('            <p/>', str(doc).splitlines())
+
+    def test_change_after_rendering_subtree_alone(self):
+        doc, body, div, p = build()
+        str(div), str(doc)
+        p.text = 'second'
+        self.assertEqual(str(doc), str(build('second')[0]))
+        self.assertEqual(str(div), str(build('second')[2]))
+
+    def test_shared_child_invalidates_every_parent(self):
+        first, second = Tag('div'), Tag('div')
+        shared = Tag('span')
+        first += shared
+        second += shared
+        str(first), str(second)
+        shared.text = 'changed'
+        self.assertIn('changed', str(first))
+        self.assertIn('changed', str(second))
+
+    def test_other_indent_or_offset_is_not_served_from_cache(self):
+        doc, body, div, p = build()
+        str(doc)
+        self.assertEqual(div.get_lines(indent='--', set_offset=1)[0], '--<div class="container">')
+        self.assertEqual(str(doc), str(build()[0]))
+
+    def test_cache_can_be_turned_off(self):
+        doc, body, div, p = build()
+        Tag.cache_output = False
+        try:
+            str(doc)
+            div.children.append(Tag('hr', is_single=True)) # в обход '+=' кэш не сбрасывается
+            self.assertIn('<hr/>', str(doc))
+        finally:
+            Tag.cache_output = True
+
+    def test_shared_child_does_not_keep_parents_alive(self):
+        nav = Tag('nav')
+        nav.text = 'menu'
+        pages = []
+        for _ in range(3):
+            doc = HTML()
+            doc += nav
+            str(doc)
+            pages.append(weakref.ref(doc))
+        del doc
+        gc.collect()
+        self.assertEqual([page() for page in pages], [None, None, None])
+        nav.text = 'changed'
+        self.assertIn('changed', str(nav))
+
+
+def flushed(doc):
+    # содержимое файла, в который HTML.flush() записал документ
+    fd, path = tempfile.mkstemp(suffix='.html')
+    os.close(fd)
+    try:
+        doc.output = path
+        doc.flush()
+        with open(path, encoding='UTF-8', newline='') as fp:
+            return fp.read()
+    finally:
+        os.remove(path)
+
+
+class FlushTest(unittest.TestCase):
+    def test_file_matches_str(self):
+        doc = build()[0]
+        self.assertEqual(flushed(doc), str(doc))
+        self.assertEqual(flushed(doc), str(doc)) # второй раз -- из кэша вывода
+
+    def test_large_file_matches_str(self):
+        doc = HTML()
+        for i in range(5000):
+            item = Tag('li', data_n=i)
+            item.text = f'item {i}'
+            doc += item
+        self.assertEqual(flushed(doc), str(doc))
+        doc += Tag('hr', is_single=True)
+        self.assertEqual(flushed(doc), str(doc))
+
+
+class DeepTreeTest(unittest.TestCase):
+    def test_deep_chain_renders_without_recursion(self):
+        # 5000 уровней -- много больше предела рекурсии; пустой отступ, чтобы строки не росли с глубиной
+        doc = HTML()
+        doc.indent = ''
+        node = doc
+        for _ in range(5000):
+            child = Tag('div')
+            node += child
+            node = child
+        node.text = 'deep'
+        expected = ['<html>'] + ['<div>'] * 5000 + ['deep'] + ['</div>'] * 5000 + ['</html>']
+        self.assertEqual(str(doc).split('\n'), expected)
+        self.assertEqual(flushed(doc), '\n'.join(expected))
+
+
+class IndentTest(unittest.TestCase):
+    def test_root_indent_applies_to_whole_tree(self):
+        doc, body, div, p = build()
+        doc.indent = '--'
+        self.assertEqual(str(doc).splitlines(), [
+            '<html>', '--<body>', '----<div class="container">', '------<p>', '--------first',
+            '------</p>', '----</div>', '--</body>', '</html>',
+        ])
+        self.assertEqual(Tag('p').indent, Tag.default_indent)
+
+    def test_child_indent_applies_when_child_is_rendered_alone(self):
+        doc, body, div, p = build()
+        div.indent = '\t'
+        self.assertEqual(str(doc), str(build()[0])) # внутри документа действует отступ корня
+        self.assertEqual(str(div).splitlines(), ['<div class="container">', '\t<p>', '\t\tfirst', '\t</p>', '</div>'])
+
+
+class TopLevelTagTest(unittest.TestCase):
+    def test_top_level_tag_is_a_paired_tag(self):
+        top = TopLevelTag('body', klass=('main', 'dark'), data_id=1)
+        self.assertIsInstance(top, Tag)
+        self.assertEqual(str(top), str(Tag('body', klass=('main', 'dark'), data_id=1)))
+        self.assertEqual(str(top).splitlines(), ['<body class="main dark" data-id="1">', '</body>'])
+
+    def test_html_wraps_document(self):
+        doc = HTML()
+        doc += TopLevelTag('head')
+        self.assertEqual(str(doc).splitlines(), ['<html>', '    <head>', '    </head>', '</html>'])
+
+
+class ConstructorTest(unittest.TestCase):
+    def test_repeated_tags_render_the_same(self):
+        first, second = Tag('td', klass=('cell', 'wide')), Tag('td', klass=('cell', 'wide'))
+        self.assertEqual(str(first), str(second))
+        self.assertEqual(str(first).splitlines()[0], '<td class="cell wide">')
+
+    def test_tags_support_weak_references(self):
+        for tag in (Tag('p'), TopLevelTag('body'), HTML()):
+            self.assertIs(weakref.ref(tag)(), tag)
+
+    def test_attributes_are_not_shared_between_tags(self):
+        first = Tag('p')
+        first.attributes['id'] = 'x'
+        self.assertEqual(Tag('p').attributes, {})
+        rows = Tag.many('li', [('a', None), ('b', None)], klass='item')
+        rows[0].attributes['id'] = 'x'
+        self.assertEqual(rows[1].attributes, {'class': 'item'})
+
+    def test_is_single_can_be_changed_after_construction(self):
+        tag = Tag('br', klass='x')
+        tag.is_single = True
+        self.assertEqual(str(tag), '<br class="x"/>')
+        tag.is_single = False
+        self.assertEqual(str(tag), '<br class="x">\n</br>')
+
+    def test_unsupported_klass_is_ignored(self):
+        for klass in (5, {'a'}, None):
+            self.assertEqual(str(Tag('p', klass=klass)).splitlines()[0], '<p>')
+
+
+class EscapeTest(unittest.TestCase):
+    def test_text_and_attributes_are_escaped(self):
+        tag = Tag('p', title='a "b" & <c>', data_n=3)
+        tag.text = '1 < 2 & 3 > 2'
+        self.assertEqual(str(tag).splitlines(), [
+            '<p title="a &quot;b&quot; &amp; &lt;c&gt;" data-n="3">',
+            '    1 &lt; 2 &amp; 3 &gt; 2',
+            '</p>',
+        ])
+
+    def test_plain_text_is_kept_as_is(self):
+        tag = Tag('p', alt="It's me")
+        tag.text = "It's plain"
+        self.assertEqual(str(tag).splitlines(), ['<p alt="It\'s me">', "    It's plain", '</p>'])
+
+
+class AttributeNameTest(unittest.TestCase):
+    def test_attribute_names_are_interned(self):
+        name = ''.join(['da', 'ta'])
+        tag = Tag('p', **{name: 1})
+        key, = tag.attributes
+        self.assertIs(key, sys.intern('data'))
+        row, = Tag.many('li', [('x', {''.join(['ti', 'tle']): 'y'})])
+        self.assertIs(list(row.attributes)[-1], sys.intern('title'))
+
+
+class ManyTest(unittest.TestCase):
+    def test_rows_render_like_constructed_tags(self):
+        rows = Tag.many('li', [('first', None), ('', {'data_id': 2}), (None, None)], klass='item')
+        expected = []
+        for text, attrs in (('first', {}), ('', {'data_id': 2}), (None, {})):
+            tag = Tag('li', klass='item', **attrs)
+            if text:
+                tag.text = text
+            expected.append(str(tag))
+        self.assertEqual([str(row) for row in rows], expected)
+        self.assertNotIn('None', str(rows[2]))
+
+
+class NestingTest(unittest.TestCase):
+    def test_self_insertion_is_refused(self):
+        tag = Tag('div')
+        with self.assertRaises(ValueError):
+            tag += tag
+
+    def test_ancestor_insertion_is_refused(self):
+        doc, body, div, p = build()
+        with self.assertRaises(ValueError):
+            p += doc
+        self.assertEqual(p.children, [])
+
+    def test_extend_skips_non_tags(self):
+        doc, body, div, p = build()
+        str(doc)
+        item = Tag('li')
+        div += [item, 'junk']
+        self.assertEqual(div.children, [p, item])
+        expected, _, expected_div, _ = build()
+        expected_div += Tag('li')
+        self.assertEqual(str(doc), str(expected))
+        item.text = 'changed'
+        self.assertIn('changed', str(doc))
+
+    def test_extend_refuses_ancestor_without_changes(self):
+        doc, body, div, p = build()
+        before = str(doc)
+        with self.assertRaises(ValueError):
+            p.extend([Tag('b'), body])
+        self.assertEqual(p.children, [])
+        self.assertEqual(str(doc), before)
+
+    def test_readded_child_updates_every_copy(self):
+        # каждый тэг добавлен в родителя дважды: в выводе у листа 2**12 копий, и все они обновляются
+        root = node = Tag('div')
+        for _ in range(12):
+            child = Tag('div')
+            node += child
+            node += child
+            node = child
+        str(root)
+        node.text = 'deep'
+        self.assertEqual(str(root).count('deep'), 2 ** 12)
+
+    def test_nested_readds_stay_linear(self):
+        # цепочка родителей не должна удваиваться на каждом уровне
+        root = node = Tag('div')
+        for _ in range(200):
+            child = Tag('div')
+            node += child
+            node += child
+            node = child
+        node.text = 'deep'
+        node += Tag('p')
+
+if __name__ == '__main__':
+    unittest.main()